@@ -1,33 +1,122 @@
-import json
+import orjson
 import os
+import queue
+import threading
+import time
+
+# How long the writer keeps collecting queued messages before one batched append
+WRITE_BATCH_SECONDS = 0.1
+
+# Queue sentinel telling the writer thread to exit
+_STOP = object()
 
 class ChatMemory:
     def __init__(self, user_id):
-        self.file_path = f"chat_memory_{user_id}.json"
-    
+        self.file_path = f"chat_memory_{user_id}.jsonl"
+        self._cache: list | None = None
+        self._lock = threading.Lock()
+        self._q = queue.Queue()
+        self._closed = False
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+
     def load_history(self):
-        if os.path.exists(self.file_path):
-            try:
-                with open(self.file_path, 'r', encoding='utf-8') as file:
-                    return json.load(file)
-            except (json.JSONDecodeError, FileNotFoundError):
-                return []
-        return []
-    
+        if self._cache is None:
+            self._cache = []
+            if os.path.exists(self.file_path):
+                try:
+                    with open(self.file_path, 'rb') as file:
+                        for line_number, line in enumerate(file, 1):
+                            if not line.strip():
+                                continue
+                            # A torn line (e.g. a crash mid-append) loses only that record
+                            try:
+                                self._cache.append(orjson.loads(line))
+                            except orjson.JSONDecodeError:
+                                print(f"Note: Skipping unreadable chat memory line {line_number} in {self.file_path}")
+                except FileNotFoundError:
+                    self._cache = []
+        return self._cache
+
     def save_history(self, history):
-        with open(self.file_path, 'w', encoding='utf-8') as file:
-            json.dump(history, file, indent=2)
-    
+        # Let queued appends land first so they are not written after the rewrite
+        self.flush()
+        with self._lock:
+            with open(self.file_path, 'wb') as file:
+                file.write(b"".join(orjson.dumps(message) + b"\n" for message in history))
+            self._cache = list(history)
+
     def get_all(self):
-        return self.load_history()
-    
+        return list(self.load_history())
+
+    def export(self, path):
+        """Writes the full history to path as indented JSON for reading by humans."""
+        with open(path, 'wb') as file:
+            file.write(orjson.dumps(self.get_all(), option=orjson.OPT_INDENT_2))
+
     def put_messages(self, messages):
-        history = self.load_history()
-        history.append(messages)
-        self.save_history(history)
-    
+        self.load_history().append(messages)
+        # Checked and enqueued under the lock so commit() cannot slip _STOP in between
+        with self._lock:
+            if self._closed:
+                self._append([messages])
+            else:
+                self._q.put(messages)
+
+    def flush(self):
+        """Blocks until every queued message has been written to disk."""
+        self._q.join()
+
+    def commit(self):
+        """Drains the write queue and stops the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._q.put(_STOP)
+        self._writer.join()
+
+    def _writer_loop(self):
+        while True:
+            batch = [self._q.get()]
+            deadline = time.monotonic() + WRITE_BATCH_SECONDS
+            while batch[-1] is not _STOP:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._q.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            messages = [message for message in batch if message is not _STOP]
+            try:
+                if messages:
+                    with self._lock:
+                        self._append(messages)
+            except Exception as e:
+                print(f"Note: Could not write chat memory: {e}")
+            finally:
+                for _ in batch:
+                    self._q.task_done()
+
+            if batch[-1] is _STOP:
+                return
+
+    def _append(self, messages):
+        with open(self.file_path, 'ab+') as file:
+            # Start on a fresh line if the last write was cut off before its newline
+            prefix = b""
+            if file.tell() > 0:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    prefix = b"\n"
+            file.write(prefix + b"".join(orjson.dumps(message) + b"\n" for message in messages))
+            file.flush()
+
     def clear_history(self):
         """Clears the chat history to start a new conversation."""
+        self.flush()
         if os.path.exists(self.file_path):
             os.remove(self.file_path)
         self.save_history([])
\ No newline at end of file
@@ -1,10 +1,92 @@
 import os
+import re
+import atexit
+import threading
 from pathlib import Path
+from cachetools import TTLCache
 from simple_agent import SimpleWorkingAgent
 
 # Cache for agents by user_id
 _agent_cache = {}
 
+# Per-user locks so concurrent first queries build only one agent per user
+_agent_cache_lock = threading.Lock()
+_user_locks: dict[str, threading.Lock] = {}
+
+# Short-lived cache of responses keyed by (user_id, normalized query)
+_response_cache = TTLCache(maxsize=512, ttl=90)
+_response_cache_lock = threading.Lock()
+
+# Queries mentioning dates or times are never served from the cache
+_TIME_SENSITIVE_RE = re.compile(
+    r"\b(today|tonight|now|yesterday|tomorrow|\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{2,4}|\d{1,2}:\d{2})\b",
+    re.IGNORECASE
+)
+
+def is_time_sensitive(query: str) -> bool:
+    """True when a query mentions dates or times, so its answer must not be cached."""
+    return bool(_TIME_SENSITIVE_RE.search(query))
+
+@atexit.register
+def _commit_chat_memories():
+    """Flush every cached agent's chat memory when the server shuts down."""
+    for agent in list(_agent_cache.values()):
+        if agent.chat_memory:
+            agent.chat_memory.commit()
+
+def _get_agent(user_id: str) -> SimpleWorkingAgent:
+    """Get or create the agent for this user."""
+    # Set up paths
+    BASE_DIR = Path(__file__).resolve().parent.parent
+    data_dir = str(BASE_DIR / "dataStorage")
+    storage_dir = str(BASE_DIR / "indexStorage")
+    
+    if user_id not in _agent_cache:
+        with _agent_cache_lock:
+            user_lock = _user_locks.setdefault(user_id, threading.Lock())
+        with user_lock:
+            if user_id not in _agent_cache:
+                print(f"Creating new agent for user: {user_id}")
+                _agent_cache[user_id] = SimpleWorkingAgent(data_dir, storage_dir, user_id)
+    
+    return _agent_cache[user_id]
+
+def clear_user_history(user_id: str) -> None:
+    """Clears the user's chat history along with their cached responses."""
+    _get_agent(user_id).chat_memory.clear_history()
+    with _response_cache_lock:
+        for cached_key in [k for k in _response_cache.keys() if k[0] == user_id]:
+            _response_cache.pop(cached_key, None)
+
+def compute_response(query: str, user_id: str) -> tuple[str, bool]:
+    """
+    Answer a query from the response cache or the agent, without touching chat history.
+    
+    Returns:
+        (response, ok) where ok is False for error and timeout fallbacks,
+        which are never cached
+    """
+    cacheable = not is_time_sensitive(query)
+    key = (user_id, query.strip().lower())
+    
+    if cacheable:
+        with _response_cache_lock:
+            response = _response_cache.get(key)
+        if response is not None:
+            return response, True
+    
+    response, ok = _get_agent(user_id).query_with_status(query)
+    
+    if cacheable and ok:
+        with _response_cache_lock:
+            _response_cache[key] = response
+    
+    return response, ok
+
+def record_exchange(query: str, user_id: str, response: str) -> None:
+    """Saves a question and the answer shown for it to the user's chat history."""
+    _get_agent(user_id).save_to_memory(query, response)
+
 def get_query_response(query: str, user_id: str, clear_history: bool = False) -> str:
     """
     Get response from the agent for a given query.
@@ -18,25 +100,12 @@ def get_query_response(query: str, user_id: str, clear_history: bool = False) ->
         Agent's response as string
     """
     try:
-        # Set up paths
-        BASE_DIR = Path(__file__).resolve().parent.parent
-        data_dir = str(BASE_DIR / "dataStorage")
-        storage_dir = str(BASE_DIR / "indexStorage")
-        
-        # Get or create agent for this user
-        if user_id not in _agent_cache:
-            print(f"Creating new agent for user: {user_id}")
-            _agent_cache[user_id] = SimpleWorkingAgent(data_dir, storage_dir, user_id)
-        
-        agent = _agent_cache[user_id]
-        
         # Clear history if requested
         if clear_history:
-            agent.chat_memory.clear_history()
-        
-        # Get response
-        response = agent.query(query)
+            clear_user_history(user_id)
         
+        response, _ = compute_response(query, user_id)
+        record_exchange(query, user_id, response)
         return response
         
     except Exception as e:
@@ -1,17 +1,130 @@
 import os
+import asyncio
+import threading
+import aiohttp
+import io
+import mmap
+import orjson
+import zstandard
 import requests
 from pathlib import Path
-from bs4 import BeautifulSoup
+from typing import Iterator
+import lxml.html
 from llama_index.core import SimpleDirectoryReader, Document
+from llama_index.core.readers.base import BaseReader
 from dotenv import load_dotenv
-from langchain_community.document_loaders import WebBaseLoader
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin, urlparse, urlunparse, urlencode, parse_qsl
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 BASE_DIR = Path(__file__).resolve().parent.parent
 DEFAULT_DATA_DIR = os.path.join(BASE_DIR, "dataStorage")
 
+# All crawled pages live in one zstd-compressed JSON Lines file of {"url", "text"} records
+CORPUS_FILENAME = "corpus.jsonl.zst"
+
+# Older crawls wrote one page_<n>_<host>_<path>.txt file per page; once a corpus
+# exists they are skipped when loading, but left on disk
+LEGACY_PAGE_PREFIX = "page_"
+
+# Text files larger than this are memory-mapped instead of read
+MMAP_THRESHOLD = 256 * 1024
+
+# Crawler concurrency settings
+FETCH_CONCURRENCY = 16
+FETCH_LIMIT_PER_HOST = 4
+FETCH_TIMEOUT = 30.0
+FETCH_MAX_CONNECTIONS = 32
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 0.3  # Seconds, doubled on every retry
+
+
+# Above this many pages the visited set is swapped for a Bloom filter to cap memory
+BLOOM_FILTER_THRESHOLD = 10_000
+
+
+def _norm(url: str) -> str:
+    """Canonical form of a URL, used as the key for pages already visited."""
+    parsed = urlparse(url)
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if not key.startswith('utm_')
+    ))
+    return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), parsed.path.rstrip('/') or '/', '', query, ''))
+
+
+async def fetch(url: str, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore) -> tuple:
+    """Fetch the raw HTML of a page, bounded by the shared semaphore.
+    Connection errors, timeouts and 5xx responses are retried with backoff.
+    Returns the final URL after redirects, the raw body and the charset
+    from the Content-Type header (None when the server sends none)."""
+    for attempt in range(FETCH_RETRIES + 1):
+        try:
+            async with semaphore:
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT)) as response:
+                    response.raise_for_status()
+                    # Bytes, not text: lxml rejects str input that carries an XML encoding declaration
+                    return str(response.url), await response.read(), response.charset
+        except (aiohttp.ClientConnectionError, aiohttp.ClientResponseError, asyncio.TimeoutError) as e:
+            retryable = not isinstance(e, aiohttp.ClientResponseError) or e.status >= 500
+            if not retryable or attempt == FETCH_RETRIES:
+                raise
+        await asyncio.sleep(FETCH_BACKOFF * 2 ** attempt)
+
+
+def parse_page(html: bytes, charset: str = None) -> tuple:
+    """Parse HTML once and return the page text along with every link href.
+    Without a header charset lxml detects it from the document itself."""
+    parser = lxml.html.HTMLParser(encoding=charset) if charset else None
+    tree = lxml.html.fromstring(html, parser=parser)
+    for element in tree.xpath('//script|//style'):
+        element.drop_tree()
+    return tree.text_content() + "\n", tree.xpath('//a/@href')
+
+
+async def fetch_and_parse(url: str, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore,
+                          executor: ThreadPoolExecutor) -> tuple:
+    """Fetch a page and parse it on the executor, so parsing overlaps other fetches."""
+    final_url, html, charset = await fetch(url, session, semaphore)
+    text_content, hrefs = await asyncio.get_running_loop().run_in_executor(executor, parse_page, html, charset)
+    return final_url, text_content, hrefs
+
+
+class CorpusReader(BaseReader):
+    """Streams the crawled pages stored in a compressed corpus file as Documents."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def iter_records(self) -> Iterator[dict]:
+        with open(self.path, 'rb') as file, \
+                zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True) as reader:
+            for line in io.TextIOWrapper(reader, encoding='utf-8'):
+                if line.strip():
+                    yield orjson.loads(line)
+
+    def lazy_load_data(self) -> Iterator[Document]:
+        for record in self.iter_records():
+            yield Document(text=record['text'], metadata={'url': record['url']})
+
+    def load_data(self) -> list:
+        return list(self.lazy_load_data())
+
+
+class MmapTextReader(BaseReader):
+    """Reads text files, memory-mapping large ones to skip the userspace read copy."""
+
+    def load_data(self, file: Path, extra_info: dict = None) -> list:
+        if os.path.getsize(file) > MMAP_THRESHOLD:
+            with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                text = str(mm, 'utf-8', 'ignore')
+        else:
+            with open(file, 'r', encoding='utf-8', errors='ignore') as f:
+                text = f.read()
+        return [Document(text=text, metadata=extra_info or {})]
+
+
 class DataLoader:
     def __init__(self, directory: str = DEFAULT_DATA_DIR):
         self.directory = directory
@@ -20,10 +133,37 @@ class DataLoader:
         if not os.path.exists(self.directory):
             os.makedirs(self.directory)
             print(f"Created directory: {self.directory}")
+        
+        # One event loop and HTTP session reused by every crawl this loader runs,
+        # so keep-alive connections and TLS sessions survive between crawls
+        self._loop = None
+        self._session = None
+        # The loop can only run one crawl at a time, so callers on other threads queue here
+        self._crawl_lock = threading.Lock()
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=FETCH_MAX_CONNECTIONS,
+                limit_per_host=FETCH_LIMIT_PER_HOST
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+    
+    def close(self) -> None:
+        """Closes the shared HTTP session and its event loop."""
+        with self._crawl_lock:
+            if self._loop is None:
+                return
+            if self._session is not None:
+                self._loop.run_until_complete(self._session.close())
+                self._session = None
+            self._loop.close()
+            self._loop = None
     
     def convert_webpages_to_text_documents(self, urls: list, crawl_depth: int = 1, max_pages: int = 50) -> None:
         """
-        Converts webpages to text files with crawling capability.
+        Converts webpages to text records in the corpus file with crawling capability.
         
         Args:
             urls: Initial URLs to crawl
@@ -31,73 +171,125 @@ class DataLoader:
             max_pages: Maximum total pages to crawl
         """
         print(f"Converting webpages with crawl_depth={crawl_depth}, max_pages={max_pages}")
-        
-        visited = set()
+        with self._crawl_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._crawl(urls, crawl_depth, max_pages))
+    
+    async def _crawl(self, urls: list, crawl_depth: int, max_pages: int) -> None:
+        """
+        Breadth-first crawl that fetches each depth frontier concurrently
+        over the loader's keep-alive session and parses pages on a thread pool
+        (lxml releases the GIL while parsing).
+        """
+        if max_pages > BLOOM_FILTER_THRESHOLD:
+            from pybloom_live import ScalableBloomFilter
+            visited = ScalableBloomFilter(initial_capacity=max_pages * 2, error_rate=0.001)
+        else:
+            visited = set()
         to_visit = deque([(url, 0) for url in urls])  # (url, depth)
         pages_processed = 0
+        saved = set()  # normalized URLs written to the new corpus
+        gone = set()  # normalized URLs answered with a 4xx
+        failed_pages = 0
+        semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+        session = self._get_session()
         
-        while to_visit and pages_processed < max_pages:
-            current_url, current_depth = to_visit.popleft()
-            
-            if current_url in visited:
-                continue
-                
-            visited.add(current_url)
-            
-            try:
-                print(f"Processing ({pages_processed+1}/{max_pages}): {current_url}")
-                
-                # Use WebBaseLoader to fetch content
-                loader = WebBaseLoader(web_paths=[current_url])
-                docs = loader.load()
-                
-                text_content = ""
-                for doc in docs:
-                    if hasattr(doc, 'page_content'):
-                        text_content += doc.page_content + "\n"
-                    elif hasattr(doc, 'content'):
-                        text_content += doc.content + "\n"
-                    else:
-                        text_content += str(doc) + "\n"
-                
-                # Clean filename from URL
-                parsed = urlparse(current_url)
-                path_parts = parsed.path.strip('/').replace('/', '_')
-                filename = f"page_{pages_processed+1}_{parsed.netloc}_{path_parts}.txt"
-                filename = filename.replace('.html', '').replace('.htm', '')[:100]  # Limit filename length
-                
-                file_path = os.path.join(self.directory, filename)
-                
-                with open(file_path, 'w', encoding='utf-8') as file:
-                    file.write(f"URL: {current_url}\n\n{text_content}")
+        # Write to a temp file and swap it in at the end, so a failed crawl keeps the old corpus
+        corpus_path = os.path.join(self.directory, CORPUS_FILENAME)
+        tmp_path = corpus_path + ".tmp"
+        
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor, \
+                zstandard.ZstdCompressor().stream_writer(open(tmp_path, 'wb')) as corpus:
+            while to_visit and pages_processed < max_pages:
+                # Pop the next batch of unvisited URLs from the current depth
+                current_depth = to_visit[0][1]
+                layer = []
+                while (to_visit and to_visit[0][1] == current_depth
+                       and len(layer) < max_pages - pages_processed):
+                    current_url, _ = to_visit.popleft()
+                    if _norm(current_url) in visited:
+                        continue
+                    visited.add(_norm(current_url))
+                    layer.append(current_url)
                 
-                print(f"✅ Saved {len(text_content)} characters to {file_path}")
-                pages_processed += 1
+                if not layer:
+                    continue
                 
-                # Extract links if we haven't reached max depth
-                if current_depth < crawl_depth:
-                    soup = BeautifulSoup(text_content, 'html.parser')
-                    for link in soup.find_all('a', href=True):
-                        absolute_url = urljoin(current_url, link['href'])
-                        # Only add links from same domain
-                        if urlparse(absolute_url).netloc == urlparse(current_url).netloc:
-                            if absolute_url not in visited:
-                                to_visit.append((absolute_url, current_depth + 1))
+                pages = await asyncio.gather(
+                    *[fetch_and_parse(url, session, semaphore, executor) for url in layer],
+                    return_exceptions=True
+                )
                 
-            except Exception as e:
-                print(f"Error processing {current_url}: {e}")
-                continue
+                for current_url, page in zip(layer, pages):
+                    if isinstance(page, Exception):
+                        print(f"Error processing {current_url}: {page}")
+                        # A 4xx means the page is gone; anything else may work next time
+                        if isinstance(page, aiohttp.ClientResponseError) and page.status < 500:
+                            gone.add(_norm(current_url))
+                        else:
+                            failed_pages += 1
+                        continue
+                    
+                    # Redirect targets (e.g. http -> https) count as visited too
+                    final_url, text_content, hrefs = page
+                    visited.add(_norm(final_url))
+                    
+                    try:
+                        print(f"Processing ({pages_processed+1}/{max_pages}): {current_url}")
+                        
+                        corpus.write(orjson.dumps({"url": current_url, "text": text_content}) + b"\n")
+                        saved.add(_norm(current_url))
+                        
+                        print(f"✅ Saved {len(text_content)} characters to {CORPUS_FILENAME}")
+                        pages_processed += 1
+                        
+                        # Extract links if we haven't reached max depth
+                        if current_depth < crawl_depth:
+                            for href in hrefs:
+                                absolute_url = urljoin(final_url, href)
+                                # Only add links from same domain
+                                if urlparse(absolute_url).netloc == urlparse(final_url).netloc:
+                                    if _norm(absolute_url) not in visited:
+                                        to_visit.append((absolute_url, current_depth + 1))
+                        
+                    except Exception as e:
+                        print(f"Error processing {current_url}: {e}")
+                        failed_pages += 1
+                        continue
+            
+            # A failed page, and anything only linked from it, would otherwise look removed
+            # and have its chunks deleted; keep the previous records until a clean crawl
+            if failed_pages and pages_processed and os.path.exists(corpus_path):
+                carried_over = 0
+                for record in CorpusReader(corpus_path).iter_records():
+                    if _norm(record['url']) not in saved and _norm(record['url']) not in gone:
+                        saved.add(_norm(record['url']))
+                        corpus.write(orjson.dumps(record) + b"\n")
+                        carried_over += 1
+                print(f"⚠️ {failed_pages} pages failed, kept {carried_over} pages from the previous corpus")
         
+        if pages_processed:
+            os.replace(tmp_path, corpus_path)
+        else:
+            os.remove(tmp_path)
         print(f"Crawling complete. Processed {pages_processed} pages.")
     
-    def load_documents(self, urls: list = None, crawl_depth: int = 1, max_pages: int = 50):
+    @staticmethod
+    def _is_legacy_page(name: str) -> bool:
+        return name.startswith(LEGACY_PAGE_PREFIX) and name.endswith(".txt")
+    
+    def load_documents(self, urls: list = None, crawl_depth: int = 1, max_pages: int = 50) -> Iterator[Document]:
         """
-        Load documents from directory, downloading from URLs if provided.
+        Stream documents from directory, downloading from URLs if provided.
         
         Args:
             urls: URLs to crawl
             crawl_depth: How deep to crawl (0=only URLs, 1=1 level deep, etc.)
             max_pages: Maximum pages to crawl total
+        
+        Yields:
+            One Document at a time, so callers never hold the whole corpus in memory
         """
         if urls:
             print(f"Converting webpages to text documents...")
@@ -107,18 +299,34 @@ class DataLoader:
             print(f"Directory does not exist: {self.directory}")
             raise Exception(f"Directory does not exist: {self.directory}")
         
-        # Check if directory has files
-        files = os.listdir(self.directory)
-        print(f"Found {len(files)} files in {self.directory}: {files[:5]}...")  # Show first 5 files
+        # Crawled pages come from the corpus; any other files are read as regular documents
+        # scandir's DirEntry answers is_file() from the directory listing, without an extra stat
+        corpus_path = os.path.join(self.directory, CORPUS_FILENAME)
+        has_corpus = os.path.exists(corpus_path)
+        # Legacy page files duplicate the corpus, so they are only read when there is no corpus
+        entries = [entry for entry in os.scandir(self.directory)
+                   if entry.is_file() and not entry.name.startswith(('.', CORPUS_FILENAME))
+                   and not (has_corpus and self._is_legacy_page(entry.name))]
+        files = [entry.name for entry in entries]
+        print(f"Found {'a corpus and ' if has_corpus else ''}{len(files)} other files in {self.directory}: {files[:5]}...")  # Show first 5 files
         
-        if not files:
+        if not has_corpus and not files:
             print("No files found in directory!")
-            return []
+            return
         
-        try:
-            documents = SimpleDirectoryReader(self.directory).load_data()
-            print(f"Loaded {len(documents)} documents from directory")
-            return documents
-        except Exception as e:
-            print(f"Error loading documents: {e}")
-            return []
\ No newline at end of file
+        # Reader errors propagate: a stream that stops early must not look like a complete one,
+        # or the index would treat every document not yet read as stale
+        count = 0
+        if has_corpus:
+            for document in CorpusReader(corpus_path).lazy_load_data():
+                count += 1
+                yield document
+        if files:
+            reader = SimpleDirectoryReader(
+                input_files=[entry.path for entry in entries],
+                file_extractor={".txt": MmapTextReader()}
+            )
+            for documents in reader.iter_data():
+                count += len(documents)
+                yield from documents
+        print(f"Loaded {count} documents from directory")
@@ -0,0 +1,59 @@
+import hashlib
+from typing import List
+from diskcache import Cache
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+# Upper bound on the on-disk cache; diskcache evicts old entries past this
+EMBED_CACHE_SIZE_LIMIT = 2 ** 30
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Wraps an embedding model with a persistent text -> vector cache, so
+    re-chunking an unchanged corpus skips the model forward pass.
+    Query embeddings are passed straight through.
+    """
+
+    _embed_model = PrivateAttr()
+    _cache = PrivateAttr()
+    _key_prefix = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, cache_dir: str, **kwargs) -> None:
+        super().__init__(model_name=embed_model.model_name,
+                         embed_batch_size=embed_model.embed_batch_size, **kwargs)
+        self._embed_model = embed_model
+        self._cache = Cache(directory=cache_dir, size_limit=EMBED_CACHE_SIZE_LIMIT)
+        # Entries from a different model never match
+        self._key_prefix = f"{embed_model.class_name()}:{embed_model.model_name}:"
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def close(self) -> None:
+        self._cache.close()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha1((self._key_prefix + text).encode("utf-8")).hexdigest()
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        embeddings = [self._cache.get(key) for key in keys]
+
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if misses:
+            computed = self._embed_model.get_text_embedding_batch([texts[i] for i in misses])
+            with self._cache.transact():
+                for i, embedding in zip(misses, computed):
+                    self._cache.set(keys[i], embedding)
+                    embeddings[i] = embedding
+        return embeddings
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed_model.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._embed_model.aget_query_embedding(query)
\ No newline at end of file
@@ -1,15 +1,25 @@
 import os
+import time
+import atexit
+import threading
 import shutil
-from typing import List, Optional
+import hashlib
+import itertools
+from typing import Iterable, List, Optional
 from pathlib import Path
+import torch
 from llama_index.core import VectorStoreIndex, StorageContext, SimpleDirectoryReader, Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding
 from llama_index.core.node_parser import SemanticSplitterNodeParser
+from llama_index.core.schema import MetadataMode
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 import chromadb
 from chromadb import PersistentClient
 from dotenv import load_dotenv
 from data_loader import DataLoader
+from onnx_embedding import OnnxBgeEmbedding, DEFAULT_INT8_MODEL
+from embedding_cache import CachedEmbedding
 
 load_dotenv()
 
@@ -18,9 +28,75 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 DEFAULT_DATA_DIR = os.path.join(BASE_DIR, "dataStorage")
 DEFAULT_INDEX_DIR = os.path.join(BASE_DIR, "indexStorage")
 
+# Built indexes shared across Index instances, keyed by (data_dir, storage_dir)
+INDEX_CACHE_TTL = max(float(os.getenv("INDEX_CACHE_TTL", "300")), 5.0)
+_INDEX_CACHE: dict[tuple[str, str], tuple[float, VectorStoreIndex]] = {}
+
+# Per-key locks so concurrent cache misses build each index only once,
+# and so at most one refresh writes to a collection at a time
+_index_locks_lock = threading.Lock()
+_index_locks: dict[tuple[str, str], threading.Lock] = {}
+_refresh_locks: dict[tuple[str, str], threading.Lock] = {}
+
+# One loader per data directory for the life of the process, so its HTTP
+# session and keep-alive connections carry over from one crawl to the next
+_DATA_LOADERS: dict[str, DataLoader] = {}
+_data_loaders_lock = threading.Lock()
+
+def _get_data_loader(directory: str) -> DataLoader:
+    with _data_loaders_lock:
+        data_loader = _DATA_LOADERS.get(directory)
+        if data_loader is None:
+            data_loader = _DATA_LOADERS[directory] = DataLoader(directory=directory)
+        return data_loader
+
+@atexit.register
+def _close_data_loaders() -> None:
+    with _data_loaders_lock:
+        for data_loader in _DATA_LOADERS.values():
+            data_loader.close()
+        _DATA_LOADERS.clear()
+
+# Stored on every chunk so entries written by older indexing code can be told apart
+INDEX_VERSION = 1
+
+# Documents handed to the semantic splitter at a time while streaming
+PARSE_BATCH_SIZE = 8
+
+def create_embedding_model() -> BaseEmbedding:
+    """
+    Builds the embedding model: FP16 on the GPU when one is available,
+    otherwise the int8 ONNX model if it has been exported, else FP32 PyTorch.
+    """
+    model_kwargs = {"attn_implementation": "eager"}
+    device = None
+    embed_batch_size = 128  # Large batches amortize per-batch overhead on CPU
+    if torch.cuda.is_available():
+        device = "cuda"
+        model_kwargs["torch_dtype"] = torch.float16
+        embed_batch_size = 256
+    elif os.path.exists(DEFAULT_INT8_MODEL):
+        try:
+            embedding = OnnxBgeEmbedding(embed_batch_size=embed_batch_size)
+            print(f"Using int8 ONNX embedding model from {DEFAULT_INT8_MODEL}")
+            return embedding
+        except Exception as e:
+            # Missing onnxruntime, a missing or broken tokenizer dir, or an unloadable model
+            print(f"Note: ONNX embedding model unavailable ({e}), falling back to PyTorch embeddings")
+    
+    return HuggingFaceEmbedding(
+        # Use a smaller model that's still good quality
+        model_name="BAAI/bge-small-en-v1.5",  # 33M params vs 270M for Jina
+        embed_batch_size=embed_batch_size,
+        max_length=512,
+        device=device,
+        model_kwargs=model_kwargs
+    )
+
 class Index:
     def __init__(self, directory: str = DEFAULT_DATA_DIR,
-                 storage_directory: str = DEFAULT_INDEX_DIR) -> None:
+                 storage_directory: str = DEFAULT_INDEX_DIR,
+                 embedding: Optional[BaseEmbedding] = None) -> None:
         self.data_storage_directory = directory
         self.storage_directory = storage_directory
         print(f"Index class constructor: Data storage directory: {self.data_storage_directory}")
@@ -32,70 +108,97 @@ class Index:
         
         self.index = None
         
-        # ALTERNATIVE SOLUTION: Use a smaller, more efficient embedding model
-        print("Initializing smaller embedding model for better memory efficiency...")
-        self.embedding = HuggingFaceEmbedding(
-            # Use a smaller model that's still good quality
-            model_name="BAAI/bge-small-en-v1.5",  # 33M params vs 270M for Jina
-            embed_batch_size=16,  # Can use larger batch with smaller model
-            max_length=512
-        )
+        if embedding is not None:
+            # Reuse the caller's model instead of loading a second copy
+            self.embedding = embedding
+        else:
+            print("Initializing smaller embedding model for better memory efficiency...")
+            self.embedding = create_embedding_model()
         Settings.embed_model = self.embedding
         
-        # Clean ChromaDB directory if it exists
-        chroma_path = os.path.join(self.storage_directory, "chroma.sqlite3")
-        if os.path.exists(chroma_path):
-            print(f"Removing existing ChromaDB at {chroma_path}...")
-            try:
-                os.remove(chroma_path)
-                for file in os.listdir(self.storage_directory):
-                    if file.startswith("chroma"):
-                        os.remove(os.path.join(self.storage_directory, file))
-            except Exception as e:
-                print(f"Warning: Could not remove old ChromaDB files: {e}")
-        
         # Initialize Chroma client
         self.chroma_client = PersistentClient(path=self.storage_directory)
         self.collection_name = "rag_index"  
 
-    def create_index(self, documents: List) -> VectorStoreIndex:
-        """Creates an index from the provided documents."""
+    def create_index(self, documents: Iterable) -> VectorStoreIndex:
+        """
+        Creates or incrementally updates the index from the provided documents.
+        Documents are consumed as a stream and only new or changed ones are embedded.
+        """
+        _INDEX_CACHE.pop(self._cache_key(), None)
+        # Sentence embeddings used to find semantic breakpoints are cached on disk across runs
+        splitter_embedding = CachedEmbedding(self.embedding, os.path.join(self.storage_directory, "embed_cache"))
         try:
-            print(f"Creating index from {len(documents)} documents...")
+            print("Creating index from documents...")
             
-            # Delete existing collection if it exists
-            try:
-                self.chroma_client.delete_collection(name=self.collection_name)
-                print(f"Deleted existing collection: {self.collection_name}")
-            except:
-                pass
+            chroma_collection = self.chroma_client.get_or_create_collection(
+                name=self.collection_name,
+                metadata={"hnsw:space": "cosine"}
+            )
+            indexed_ids = self._indexed_doc_ids(chroma_collection)
+            
+            vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+            storage_context = StorageContext.from_defaults(vector_store=vector_store)
+            index = VectorStoreIndex.from_vector_store(
+                vector_store=vector_store,
+                storage_context=storage_context,
+                embed_model=self.embedding
+            )
             
             # Parse documents into nodes
             parser = SemanticSplitterNodeParser(
-                embed_model=self.embedding,
+                embed_model=splitter_embedding,
                 max_chunk_size=768,  # Balanced chunk size
                 breakpoint_percentile_threshold=95
             )
-            nodes = parser.get_nodes_from_documents(documents)
-            print(f"Created {len(nodes)} nodes from documents")
             
-            # Create new collection
-            chroma_collection = self.chroma_client.create_collection(
-                name=self.collection_name,
-                metadata={"hnsw:space": "cosine"}
-            )
+            indexed_at = time.time()
+            current_ids = set()
+            new_count = 0
+            node_count = 0
+            batch = []
+            nodes = []
             
-            vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-            storage_context = StorageContext.from_defaults(vector_store=vector_store)
+            def flush_nodes():
+                nonlocal nodes, node_count
+                if nodes:
+                    self._embed_nodes(nodes)
+                    index.insert_nodes(nodes)
+                    node_count += len(nodes)
+                    nodes = []
             
-            # Create index
-            index = VectorStoreIndex(
-                nodes,
-                storage_context=storage_context,
-                embed_model=self.embedding,
-                show_progress=True
-            )
+            for document in documents:
+                # Give every document a stable id so its chunks can be found again
+                document.id_ = self._document_id(document)
+                current_ids.add(document.id_)
+                if document.id_ in indexed_ids:
+                    continue
+                document.metadata["version"] = INDEX_VERSION
+                document.metadata["indexed_at"] = indexed_at
+                document.excluded_embed_metadata_keys.extend(["version", "indexed_at"])
+                document.excluded_llm_metadata_keys.extend(["version", "indexed_at"])
+                batch.append(document)
+                new_count += 1
+                
+                if len(batch) >= PARSE_BATCH_SIZE:
+                    nodes.extend(parser.get_nodes_from_documents(batch))
+                    # Raw document text is no longer needed once it has been chunked
+                    batch = []
+                if len(nodes) >= 2 * self.embedding.embed_batch_size:
+                    flush_nodes()
+            
+            if batch:
+                nodes.extend(parser.get_nodes_from_documents(batch))
+                batch = []
+            flush_nodes()
+            
+            # Drop chunks of documents that changed or no longer exist
+            stale_ids = indexed_ids - current_ids
+            if stale_ids:
+                chroma_collection.delete(where={"doc_id": {"$in": list(stale_ids)}})
             
+            print(f"{new_count} new or changed documents ({node_count} nodes), "
+                  f"{len(current_ids) - new_count} unchanged, {len(stale_ids)} stale")
             print("Index created successfully")
             return index
             
@@ -104,13 +207,131 @@ class Index:
             import traceback
             traceback.print_exc()
             raise
+        finally:
+            splitter_embedding.close()
+
+    def _embed_nodes(self, nodes: List) -> None:
+        """
+        Embeds nodes in the model's embed_batch_size batches, one batch at a time;
+        the model already parallelizes each forward pass internally.
+        """
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        embeddings = self.embedding.get_text_embedding_batch(texts)
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+        print(f"Embedded {len(nodes)} nodes")
+
+    def _document_id(self, document) -> str:
+        """
+        Hash of the embedding model plus the source file path and mtime, or the
+        text when there is no file. Switching models re-embeds every document.
+        """
+        file_path = document.metadata.get("file_path")
+        if file_path and os.path.exists(file_path):
+            key = f"{file_path}{os.path.getmtime(file_path)}"
+        else:
+            key = document.text
+        key = f"{self.embedding.class_name()}:{self.embedding.model_name}:{key}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _indexed_doc_ids(chroma_collection) -> set:
+        """Document ids that already have chunks in the collection."""
+        metadatas = chroma_collection.get(include=["metadatas"])["metadatas"] or []
+        return {metadata["doc_id"] for metadata in metadatas if metadata and "doc_id" in metadata}
+
+    def _cache_key(self) -> tuple[str, str]:
+        return (self.data_storage_directory, self.storage_directory)
+
+    def _cached_index(self) -> Optional[VectorStoreIndex]:
+        cached = _INDEX_CACHE.get(self._cache_key())
+        if cached and time.time() - cached[0] < INDEX_CACHE_TTL:
+            return cached[1]
+        return None
+
+    def _refresh_lock(self) -> threading.Lock:
+        with _index_locks_lock:
+            return _refresh_locks.setdefault(self._cache_key(), threading.Lock())
 
     def load_index(self, urls: list = None, crawl_depth: int = 1, max_pages: int = 50) -> VectorStoreIndex:
         """
-        Load existing index or create new one if it doesn't exist.
+        Create the index, or serve the stored one right away and bring it up to
+        date with the current documents in the background.
+        Results are memoized for INDEX_CACHE_TTL seconds.
         """
+        index = self._cached_index()
+        if index is not None:
+            print("Using cached index")
+            return index
+        
+        with _index_locks_lock:
+            index_lock = _index_locks.setdefault(self._cache_key(), threading.Lock())
+        with index_lock:
+            # Another caller may have built it while we waited
+            index = self._cached_index()
+            if index is not None:
+                print("Using cached index")
+                return index
+            
+            index = self._load_existing_index()
+            if index is not None:
+                # Crawling and re-reading the corpus stays off the query path
+                self.refresh_in_background(urls, crawl_depth, max_pages)
+            else:
+                with self._refresh_lock():
+                    index = self._load_or_create_index(urls, crawl_depth, max_pages)
+            if index is not None:
+                _INDEX_CACHE[self._cache_key()] = (time.time(), index)
+            return index
+
+    def refresh_in_background(self, urls: list = None, crawl_depth: int = 1, max_pages: int = 50) -> None:
+        """Start a refresh of the index on a daemon thread, unless one is already running."""
+        refresh_lock = self._refresh_lock()
+        if not refresh_lock.acquire(blocking=False):
+            print("Index refresh already running")
+            return
+        
+        def refresh():
+            try:
+                index = self._load_or_create_index(urls, crawl_depth, max_pages)
+                if index is not None:
+                    _INDEX_CACHE[self._cache_key()] = (time.time(), index)
+            finally:
+                refresh_lock.release()
+        
+        print("Refreshing index in the background...")
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def _load_or_create_index(self, urls: list, crawl_depth: int, max_pages: int) -> Optional[VectorStoreIndex]:
+        """
+        Refresh the index from the data directory (crawling urls first, if given),
+        upserting only new or changed documents. Falls back to the stored
+        collection as-is when no documents can be loaded.
+        """
+        try:
+            # Load documents with crawling
+            print(f"Loading documents from URLs with crawl_depth={crawl_depth}, max_pages={max_pages}")
+            data_loader = _get_data_loader(self.data_storage_directory)
+            documents = data_loader.load_documents(urls, crawl_depth=crawl_depth, max_pages=max_pages)
+            
+            first_document = next(documents, None)
+            if first_document is not None:
+                # Create or update the index
+                index = self.create_index(itertools.chain([first_document], documents))
+                print("Index refreshed and ready to use")
+                return index
+            print("No documents loaded!")
+            
+        except Exception as refresh_error:
+            print(f"Error refreshing index: {refresh_error}")
+            import traceback
+            traceback.print_exc()
+        
+        return self._load_existing_index()
+
+    def _load_existing_index(self) -> Optional[VectorStoreIndex]:
+        """Load the stored collection without updating it, or None if it is empty."""
         try:
-            # Try to load existing index
             print("Attempting to load existing index...")
             
             existing_collections = [col.name for col in self.chroma_client.list_collections()]
@@ -134,30 +355,9 @@ class Index:
                     print("Index loaded from existing storage")
                     return index
             
-            print("No existing index found, creating new one...")
+            print("No existing index found")
                 
         except Exception as e:
             print(f"Could not load existing index: {e}")
-            
-        # Create new index
-        try:
-            # Load documents with crawling
-            print(f"Loading documents from URLs with crawl_depth={crawl_depth}, max_pages={max_pages}")
-            data_loader = DataLoader(directory=self.data_storage_directory)
-            documents = data_loader.load_documents(urls, crawl_depth=crawl_depth, max_pages=max_pages)
-            
-            if not documents:
-                print("No documents loaded!")
-                return None
-            
-            # Create new index
-            index = self.create_index(documents)
-            
-            print("New index created and ready to use")
-            return index
-            
-        except Exception as create_error:
-            print(f"Error creating new index: {create_error}")
-            import traceback
-            traceback.print_exc()
-            return None
\ No newline at end of file
+        
+        return None
\ No newline at end of file
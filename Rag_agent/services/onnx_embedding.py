@@ -0,0 +1,79 @@
+import os
+from pathlib import Path
+from typing import List
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+MODEL_NAME = "BAAI/bge-small-en-v1.5"
+DEFAULT_ONNX_DIR = os.path.join(BASE_DIR, "models", "bge_onnx")
+DEFAULT_INT8_MODEL = os.path.join(BASE_DIR, "models", "bge_int8.onnx")
+
+# bge models expect this prefix on queries but not on passages
+QUERY_INSTRUCTION = "Represent this question for searching relevant passages: "
+
+class OnnxBgeEmbedding(BaseEmbedding):
+    """bge-small embedding running an int8-quantized ONNX model on the CPU."""
+
+    max_length: int = 512
+
+    _session = PrivateAttr()
+    _tokenizer = PrivateAttr()
+    _input_names = PrivateAttr()
+
+    def __init__(self, model_path: str = DEFAULT_INT8_MODEL, tokenizer_dir: str = DEFAULT_ONNX_DIR,
+                 embed_batch_size: int = 128, max_length: int = 512, **kwargs) -> None:
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        super().__init__(model_name=MODEL_NAME, embed_batch_size=embed_batch_size,
+                         max_length=max_length, **kwargs)
+        self._session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self._tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir)
+        self._input_names = {model_input.name for model_input in self._session.get_inputs()}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxBgeEmbedding"
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        inputs = self._tokenizer(texts, padding=True, truncation=True,
+                                 max_length=self.max_length, return_tensors="np")
+        feed = {name: inputs[name].astype(np.int64) for name in self._input_names if name in inputs}
+        last_hidden_state = self._session.run(None, feed)[0]
+
+        # bge uses the CLS token as the sentence embedding, L2-normalized
+        embeddings = last_hidden_state[:, 0]
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings.tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([QUERY_INSTRUCTION + query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
+
+
+def export_quantized_model(onnx_dir: str = DEFAULT_ONNX_DIR, model_path: str = DEFAULT_INT8_MODEL) -> None:
+    """Exports bge-small to ONNX and applies dynamic int8 weight quantization."""
+    import subprocess
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    print(f"Exporting {MODEL_NAME} to ONNX in {onnx_dir}...")
+    subprocess.run(["optimum-cli", "export", "onnx", "--model", MODEL_NAME, onnx_dir], check=True)
+
+    print(f"Quantizing to int8 at {model_path}...")
+    quantize_dynamic(os.path.join(onnx_dir, "model.onnx"), model_path, weight_type=QuantType.QInt8)
+    print("✅ Quantized embedding model ready")
+
+
+if __name__ == "__main__":
+    export_quantized_model()
\ No newline at end of file
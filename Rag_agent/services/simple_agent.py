@@ -1,14 +1,56 @@
 import os
+import re
 import asyncio
+import threading
+import concurrent.futures
 from pathlib import Path
 from llama_index.llms.ollama import Ollama
 from llama_index.core.tools import QueryEngineTool, ToolMetadata
 from llama_index.core.agent.workflow import ReActAgent
 from llama_index.core import Settings
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from index import Index
+from index import Index, create_embedding_model
 from chat_memory import ChatMemory
 
+# Technologies we have no docs for, matched as whole words; list name variants explicitly
+_UNSUPPORTED_RE = re.compile(
+    r"\b(kafka|snowflake|mongodb|mongo|redis|elasticsearch|postgres(?:ql)?|mysql)\b",
+    re.IGNORECASE
+)
+
+# Models shared by every agent so each user doesn't load their own copy
+_SHARED_EMBED = None
+_SHARED_LLM = None
+_shared_models_lock = threading.Lock()
+
+def _get_shared_models():
+    """Lazily create the embedding model and LLM once per process."""
+    global _SHARED_EMBED, _SHARED_LLM
+    with _shared_models_lock:
+        if _SHARED_EMBED is None:
+            print("Setting up models...")
+            _SHARED_EMBED = create_embedding_model()
+        if _SHARED_LLM is None:
+            # CRITICAL: Set temperature to 0 for deterministic responses
+            _SHARED_LLM = Ollama(model="llama3", request_timeout=120.0, temperature=0.0)
+        return _SHARED_EMBED, _SHARED_LLM
+
+# One long-lived event loop runs every agent's coroutines, so the shared
+# LLM client stays bound to a single loop and keeps its connections open
+_EVENT_LOOP = None
+_event_loop_lock = threading.Lock()
+
+# Seconds to wait for the agent before giving up on a query
+QUERY_TIMEOUT = 180
+
+def _get_event_loop():
+    """Lazily start the background event loop thread once per process."""
+    global _EVENT_LOOP
+    with _event_loop_lock:
+        if _EVENT_LOOP is None:
+            _EVENT_LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_EVENT_LOOP.run_forever, daemon=True).start()
+        return _EVENT_LOOP
+
 class SimpleWorkingAgent:
     def __init__(self, directory: str, storage_directory: str, user_id: str):
         self.directory = directory
@@ -29,22 +71,16 @@ class SimpleWorkingAgent:
             "https://airflow.apache.org/docs/apache-airflow/stable/core-concepts/dags.html"
         ]
         
+        # Setup models
+        embedding, llm = _get_shared_models()
+        self._loop = _get_event_loop()
+        
         print("Loading index...")
-        self.index = Index(directory, storage_directory).load_index(urls=self.urls)
+        self.index = Index(directory, storage_directory, embedding=embedding).load_index(urls=self.urls)
         
         if not self.index:
             raise ValueError("Failed to create index")
         
-        # Setup models
-        print("Setting up models...")
-        embedding = HuggingFaceEmbedding(
-            model_name="BAAI/bge-small-en-v1.5",
-            model_kwargs={"attn_implementation": "eager"}
-        )
-        
-        # CRITICAL: Set temperature to 0 for deterministic responses
-        llm = Ollama(model="llama3", request_timeout=120.0, temperature=0.0)
-        
         Settings.embed_model = embedding
         Settings.llm = llm
         
@@ -98,6 +134,12 @@ class SimpleWorkingAgent:
         
         print("ReActAgent ready with STRICT document-only mode!")
     
+    def __del__(self):
+        # Make sure queued chat messages reach disk before the agent goes away
+        chat_memory = getattr(self, "chat_memory", None)
+        if chat_memory:
+            chat_memory.commit()
+    
     def save_to_memory(self, question: str, answer: str):
         """Save Q&A to memory, handling serialization issues"""
         if self.chat_memory:
@@ -114,13 +156,25 @@ class SimpleWorkingAgent:
         """
         Simple sync wrapper for async ReActAgent
         """
-        # Pre-check for explicitly unsupported topics
-        unsupported_topics = ['kafka', 'snowflake', 'mongodb', 'redis', 'elasticsearch', 'postgres', 'mysql']
-        question_lower = question.lower()
+        result, _ = self.query_with_status(question)
         
-        for topic in unsupported_topics:
-            if topic in question_lower:
-                return f"I don't have {topic.capitalize()} documentation. I can only help with Apache Spark, dbt, and Apache Airflow based on the documents I have indexed."
+        # Save to chat memory (handling serialization)
+        self.save_to_memory(question, result)
+        
+        return result
+    
+    def query_with_status(self, question: str) -> tuple[str, bool]:
+        """
+        Answer a question without touching chat memory.
+        
+        Returns:
+            The response text, and False when it is an error or timeout
+            fallback rather than a real answer (callers must not cache those)
+        """
+        # Pre-check for explicitly unsupported topics
+        match = _UNSUPPORTED_RE.search(question)
+        if match:
+            return f"I don't have {match.group(1).capitalize()} documentation. I can only help with Apache Spark, dbt, and Apache Airflow based on the documents I have indexed.", True
         
         async def run_agent():
             try:
@@ -140,23 +194,24 @@ class SimpleWorkingAgent:
                     result = str(response)
                 
                 # Final check - if the response mentions technologies we don't have docs for
-                if any(topic in result.lower() for topic in unsupported_topics):
-                    return "I can only provide information from the Spark, dbt, and Airflow documentation I have indexed. I cannot answer about other technologies."
+                if _UNSUPPORTED_RE.search(result):
+                    return "I can only provide information from the Spark, dbt, and Airflow documentation I have indexed. I cannot answer about other technologies.", True
                 
-                return result
+                return result, True
                     
             except Exception as e:
                 print(f"Agent error: {e}")
                 # Don't fallback to general knowledge
-                return "I encountered an error searching the documentation. Please rephrase your question about Spark, dbt, or Airflow."
-        
-        # Run the async function synchronously
-        result = asyncio.run(run_agent())
+                return "I encountered an error searching the documentation. Please rephrase your question about Spark, dbt, or Airflow.", False
         
-        # Save to chat memory (handling serialization)
-        self.save_to_memory(question, result)
-        
-        return result
+        # Run the async function on the background loop and wait for it
+        future = asyncio.run_coroutine_threadsafe(run_agent(), self._loop)
+        try:
+            return future.result(timeout=QUERY_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            print(f"Agent timed out after {QUERY_TIMEOUT}s")
+            return "The documentation search took too long. Please try again or rephrase your question about Spark, dbt, or Airflow.", False
 
 
 def main():
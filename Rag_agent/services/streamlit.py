@@ -4,7 +4,25 @@ import sys
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'Rag_agent', 'services'))
 
-from chat_service import get_query_response  
+from chat_service import clear_user_history, compute_response, record_exchange, is_time_sensitive
+
+
+class _FailedResponse(Exception):
+    """Carries an error or timeout fallback out of the cached function."""
+    def __init__(self, response: str):
+        super().__init__(response)
+        self.response = response
+
+
+@st.cache_data(ttl=300, max_entries=256, show_spinner=False)
+def _cached_response(query: str, user_id: str, clear_history: bool) -> str:
+    # clear_history only keys the cache, since answers given with and without
+    # history may differ; clearing and saving history happen outside, on every run
+    response, ok = compute_response(query, user_id)
+    # Raise instead of returning so failures are never cached
+    if not ok:
+        raise _FailedResponse(response)
+    return response
 
 st.set_page_config(page_title="Data Engineering Copilot", layout="wide")
 
@@ -14,7 +32,7 @@ st.markdown("Ask me anything about Spark, dbt, Airflow — or generate a quiz!")
 
 st.sidebar.title("Options")
 user_id = st.sidebar.text_input("User ID", value="user_quiz_001")
-clear_history = st.sidebar.checkbox("Clear chat history", value=True)
+clear_history = st.sidebar.checkbox("Clear chat history", value=True, on_change=_cached_response.clear)
 
 
 query = st.text_area("Enter your query", height=150, placeholder="e.g., Generate a 5-question quiz on dbt...")
@@ -26,7 +44,18 @@ if st.button("Run Copilot"):
     else:
         with st.spinner("Thinking..."):
             try:
-                response = get_query_response(query, user_id, clear_history)
+                if clear_history:
+                    clear_user_history(user_id)
+                
+                if is_time_sensitive(query):
+                    response, _ = compute_response(query, user_id)
+                else:
+                    try:
+                        response = _cached_response(query, user_id, clear_history)
+                    except _FailedResponse as failed:
+                        response = failed.response
+                record_exchange(query, user_id, response)
+                
                 st.markdown("### Copilot Response")
                 st.markdown(response.replace("Agent response:", "").strip())
             except Exception as e: